@@ -0,0 +1,79 @@
+"""
+Collect work items in small batches before dispatching them.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('ejudge_server')
+
+
+class Batcher:
+    """
+    Collect items in per-key batches that are handed to a flush function.
+
+    A batch is flushed ``window`` seconds after its first item was added or as
+    soon as it reaches ``max_size`` items, whatever happens first.
+
+    Args:
+        flush:
+            A function flush(key, items) called with each complete batch.
+        window (float):
+            Maximum time (in seconds) that an item waits for its batch to be
+            flushed. A non-positive value flushes each item immediately.
+        max_size (int):
+            Maximum number of items in a batch.
+    """
+
+    def __init__(self, flush, window=0.5, max_size=50):
+        self.flush_function = flush
+        self.window = window
+        self.max_size = max_size
+        self._batches = OrderedDict()
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(items) for items in self._batches.values())
+
+    def add(self, key, item):
+        """
+        Add item to the batch associated with the given key.
+        """
+
+        with self._lock:
+            items = self._batches.setdefault(key, [])
+            items.append(item)
+            is_full = len(items) >= self.max_size or self.window <= 0
+            if not is_full and key not in self._timers:
+                timer = threading.Timer(self.window, self.flush, (key,))
+                timer.daemon = True
+                self._timers[key] = timer
+                timer.start()
+
+        if is_full:
+            self.flush(key)
+
+    def flush(self, key=None):
+        """
+        Flush batch for the given key. If no key is given, flush all pending
+        batches.
+        """
+
+        with self._lock:
+            keys = list(self._batches) if key is None else [key]
+            batches = []
+            for key in keys:
+                timer = self._timers.pop(key, None)
+                if timer is not None:
+                    timer.cancel()
+                items = self._batches.pop(key, None)
+                if items:
+                    batches.append((key, items))
+
+        for key, items in batches:
+            try:
+                self.flush_function(key, items)
+            except Exception:
+                logger.exception('error flushing batch %r' % (key,))
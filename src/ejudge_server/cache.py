@@ -0,0 +1,153 @@
+"""
+Small in-process caches used by the grading pipeline.
+
+These caches live in the memory of each worker process. Entries are keyed by
+a hash of their content, so stale entries are never served: at worst they
+occupy memory until they are evicted.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def content_hash(*parts):
+    """
+    Return a hex digest that uniquely identifies the given sequence of strings.
+    """
+
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf8')
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """
+    A bounded mapping that evicts the least recently used entries.
+
+    Args:
+        maxsize (int):
+            Maximum number of entries. A non-positive size disables the cache
+            and every lookup is a miss.
+
+    Attributes:
+        hits, misses, evictions (int):
+            Counters that are updated on each lookup/insertion.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = self.misses = self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """
+        Return value associated with key or default, if key is not present.
+        """
+
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Insert value in cache evicting old entries if necessary.
+        """
+
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_create(self, key, factory):
+        """
+        Return cached value for key. On a miss, call factory() to create the
+        value and store it in the cache.
+        """
+
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def discard(self, key):
+        """
+        Remove key from cache, if present.
+        """
+
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all entries and reset counters.
+        """
+
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Return a dictionary with the cache size and hit/miss counters.
+        """
+
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class HitCounter:
+    """
+    Hit/miss counters for caches that are not managed by :class:`LRUCache`.
+    """
+
+    def __init__(self):
+        self.hits = self.misses = 0
+
+    def hit(self):
+        self.hits += 1
+
+    def miss(self):
+        self.misses += 1
+
+    def stats(self):
+        """
+        Return a dictionary with the hit/miss counters.
+        """
+
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
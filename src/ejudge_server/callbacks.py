@@ -0,0 +1,210 @@
+"""
+Deliver grading results to callback urls.
+
+Submissions may define a callback url. When a submission is graded, its
+feedback is POSTed to this url as a JSON list of feedback objects::
+
+    [{"uuid": "...", "question": "...", "grade": 100.0, ...}, ...]
+
+Results that are sent to the same url in a short time window are delivered
+together in a single request. Requests reuse keep-alive connections and failed
+deliveries are retried with exponential backoff by the deliver_callbacks task.
+"""
+
+import http.client
+import json
+import logging
+import queue
+import threading
+from urllib.parse import urlsplit
+
+from celery import shared_task
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from ejudge_server.batching import Batcher
+
+logger = logging.getLogger('ejudge_server')
+
+# Failed deliveries are retried after RETRY_DELAY, 2 * RETRY_DELAY,
+# 4 * RETRY_DELAY, ... seconds, at most MAX_RETRIES times.
+RETRY_DELAY = getattr(settings, 'EJUDGE_CALLBACK_RETRY_DELAY', 2.0)
+MAX_RETRIES = getattr(settings, 'EJUDGE_CALLBACK_MAX_RETRIES', 8)
+TIMEOUT = getattr(settings, 'EJUDGE_CALLBACK_TIMEOUT', 10)
+
+
+class CallbackError(Exception):
+    """
+    Raised when a callback url cannot be reached or returns an error.
+    """
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP connections grouped by (scheme, host, port).
+
+    Args:
+        maxsize (int):
+            Maximum number of idle connections kept for each host.
+        timeout (float):
+            Socket timeout of new connections (in seconds).
+    """
+
+    def __init__(self, maxsize=4, timeout=TIMEOUT):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.connects = self.requests = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Perform request and return a tuple of (status, response body).
+
+        Requests sent through reused connections are repeated once in a fresh
+        connection if the server has closed the old one.
+        """
+
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        connection, reused = self._get(key)
+        try:
+            response = self._send(connection, method, path, body, headers)
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            if not reused:
+                raise
+            connection = self._new(key)
+            response = self._send(connection, method, path, body, headers)
+
+        data = response.read()
+        if response.will_close:
+            connection.close()
+        else:
+            self._put(key, connection)
+        return response.status, data
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+
+        with self._lock:
+            pools, self._idle = self._idle, {}
+        for idle in pools.values():
+            while not idle.empty():
+                idle.get_nowait().close()
+
+    def stats(self):
+        """
+        Return a dictionary with usage statistics.
+        """
+
+        return {
+            'connects': self.connects,
+            'requests': self.requests,
+            'idle': sum(idle.qsize() for idle in self._idle.values()),
+        }
+
+    def _send(self, connection, method, path, body, headers):
+        self.requests += 1
+        connection.request(method, path, body=body, headers=headers or {})
+        return connection.getresponse()
+
+    def _get(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+        if idle is not None:
+            try:
+                return idle.get_nowait(), True
+            except queue.Empty:
+                pass
+        return self._new(key), False
+
+    def _new(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            cls = http.client.HTTPSConnection
+        elif scheme == 'http':
+            cls = http.client.HTTPConnection
+        else:
+            raise CallbackError('invalid callback scheme: %r' % scheme)
+        self.connects += 1
+        return cls(host, port, timeout=self.timeout)
+
+    def _put(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, queue.LifoQueue(self.maxsize))
+        try:
+            idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+
+connection_pool = ConnectionPool()
+
+
+def deliver(url, payloads):
+    """
+    POST the list of payloads to url.
+
+    Raises CallbackError if the request fails or the response status is not
+    2xx.
+    """
+
+    body = json.dumps(payloads, cls=DjangoJSONEncoder).encode('utf8')
+    headers = {
+        'Content-Type': 'application/json',
+        'Content-Length': str(len(body)),
+        'Connection': 'keep-alive',
+    }
+    try:
+        status, _ = connection_pool.request('POST', url, body, headers)
+    except (http.client.HTTPException, OSError) as ex:
+        raise CallbackError('error sending callback to %s: %s' % (url, ex))
+    if not 200 <= status < 300:
+        raise CallbackError('callback to %s returned status %s' % (url, status))
+
+
+@shared_task(bind=True)
+def deliver_callbacks(self, url, payloads):
+    """
+    Deliver a batch of payloads to the given callback url.
+    """
+
+    try:
+        deliver(url, payloads)
+    except CallbackError as ex:
+        retries = self.request.retries
+        if retries >= MAX_RETRIES:
+            logger.error('giving up %s: %s' % (url, ex))
+            return
+        logger.warning('%s (retry %s)' % (ex, retries + 1))
+        raise self.retry(countdown=RETRY_DELAY * 2 ** retries,
+                         max_retries=MAX_RETRIES)
+    logger.info('delivered %s results to %s' % (len(payloads), url))
+
+
+def _flush_callbacks(url, payloads):
+    deliver_callbacks.delay(url, payloads)
+
+
+# Collects results sent to the same url and deliver them in a single request
+callback_batcher = Batcher(
+    _flush_callbacks,
+    window=getattr(settings, 'EJUDGE_CALLBACK_WINDOW', 1.0),
+    max_size=getattr(settings, 'EJUDGE_CALLBACK_BATCH_SIZE', 50),
+)
+
+
+def schedule_callback(url, payload):
+    """
+    Schedule delivery of payload to url. Does nothing if url is empty.
+    """
+
+    if url:
+        callback_batcher.add(url, payload)
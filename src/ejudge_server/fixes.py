@@ -3,3 +3,9 @@
 import billiard
 from ejudge import execution_manager as _ex
 _ex.multiprocessing = billiard
+
+# Sandboxed runs are executed by a pool of warm workers (see sandbox.py) instead
+# of starting a new sandboxed interpreter for each run
+from ejudge import functions as _functions
+from ejudge_server.sandbox import run_sandbox as _run_sandbox
+_functions.run_sandbox = _run_sandbox
@@ -0,0 +1,151 @@
+"""
+Notify clients waiting for a submission to be graded.
+
+Workers publish the uuid of each graded submission in a Redis channel. Web
+processes that serve long-polling requests subscribe to the channels of the
+submissions they are waiting for and wake up as soon as grading finishes.
+
+If Redis is not available (or EJUDGE_REDIS_URL is None), waiting falls back to
+polling the database every EJUDGE_POLL_INTERVAL seconds.
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger('ejudge_server')
+
+CHANNEL_PREFIX = 'ejudge:feedback:'
+
+# Do not try to reconnect to an unreachable Redis server for this many seconds
+RECONNECT_INTERVAL = 30
+
+_client = None
+_client_lock = threading.Lock()
+_unavailable_until = 0
+
+
+def channel(pk):
+    """
+    Name of the channel that announces that the given submission was graded.
+    """
+
+    return CHANNEL_PREFIX + str(pk)
+
+
+def get_redis():
+    """
+    Return a Redis client or None if Redis is disabled or unreachable.
+    """
+
+    global _client, _unavailable_until
+
+    url = getattr(settings, 'EJUDGE_REDIS_URL', None)
+    if not url or time.monotonic() < _unavailable_until:
+        return None
+
+    with _client_lock:
+        if _client is None:
+            try:
+                import redis
+
+                client = redis.StrictRedis.from_url(
+                    url, socket_connect_timeout=1)
+                client.ping()
+            except Exception as ex:
+                logger.warning('redis is unavailable: %s' % ex)
+                _unavailable_until = time.monotonic() + RECONNECT_INTERVAL
+                return None
+            _client = client
+        return _client
+
+
+def _disconnect(ex):
+    global _client, _unavailable_until
+
+    logger.warning('redis connection lost: %s' % ex)
+    with _client_lock:
+        _client = None
+        _unavailable_until = time.monotonic() + RECONNECT_INTERVAL
+
+
+def publish_feedback(submission_pks):
+    """
+    Announce that the given submissions were graded.
+    """
+
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        pipeline = client.pipeline(transaction=False)
+        for pk in submission_pks:
+            pipeline.publish(channel(pk), b'1')
+        pipeline.execute()
+    except Exception as ex:
+        _disconnect(ex)
+
+
+def wait_feedback(submission_pks, timeout, is_ready):
+    """
+    Wait at most timeout seconds until all given submissions are graded.
+
+    Args:
+        submission_pks:
+            List of submission uuids.
+        timeout (float):
+            Maximum wait (in seconds).
+        is_ready:
+            A function that receives a list of uuids and return the subset of
+            submissions that already have feedback.
+
+    Returns:
+        The set of uuids (as strings) of graded submissions.
+    """
+
+    pending = {str(pk) for pk in submission_pks}
+    deadline = time.monotonic() + timeout
+    client = get_redis()
+    pubsub = None
+
+    # Subscribe before checking the database so no notification is lost
+    if client is not None:
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(*[channel(pk) for pk in pending])
+        except Exception as ex:
+            _disconnect(ex)
+            pubsub = None
+
+    try:
+        pending -= {str(pk) for pk in is_ready(list(pending))}
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if pubsub is not None:
+                try:
+                    message = pubsub.get_message(timeout=remaining)
+                except Exception as ex:
+                    _disconnect(ex)
+                    pubsub = None
+                    continue
+                if message is not None:
+                    name = message['channel']
+                    if isinstance(name, bytes):
+                        name = name.decode('utf8')
+                    pending.discard(name[len(CHANNEL_PREFIX):])
+            else:
+                interval = getattr(settings, 'EJUDGE_POLL_INTERVAL', 0.5)
+                time.sleep(min(interval, remaining))
+                pending -= {str(pk) for pk in is_ready(list(pending))}
+    finally:
+        if pubsub is not None:
+            try:
+                pubsub.close()
+            except Exception:
+                pass
+
+    return {str(pk) for pk in submission_pks} - pending
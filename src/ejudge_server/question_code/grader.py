@@ -1,8 +1,11 @@
-import os
-
-import tempfile
+import base64
+import importlib.util
+import linecache
+import marshal
 import traceback
 
+from ejudge_server.cache import LRUCache, content_hash
+
 try:
     from django.utils.translation import ugettext_lazy as _
 except ImportError:
@@ -11,6 +14,10 @@ except ImportError:
 NAME_ERROR_MESSAGE = _('the code must define a {} object')
 WRONG_ANSWER_MESSAGE = _('Wrong answer')
 
+# Compiled code objects for reference and grader sources. These are the same
+# for all submissions to a question.
+code_cache = LRUCache(128)
+
 
 class FetchObjectError(Exception):
     """
@@ -18,7 +25,8 @@ class FetchObjectError(Exception):
     """
 
 
-def get_code_errors(grader, test_code, reference_code, name='func'):
+def get_code_errors(grader, test_code, reference_code, name='func',
+                    artifacts=None):
     """
     Return a string describing any code error found on the given code.
 
@@ -38,15 +46,22 @@ def get_code_errors(grader, test_code, reference_code, name='func'):
             the same function/object as the test code.
         name:
             Name of the object used for testing in each program.
+        artifacts:
+            An optional mapping with the pre-compiled "grader" and "reference"
+            code (see :func:`dump_code`).
 
     Returns:
         A string describing an error or None if the codes executed successfully.
     """
 
+    artifacts = artifacts or {}
     try:
         test = fetch_named_object(test_code, name, 'code.py')
-        reference = fetch_named_object(reference_code, name, 'reference.py')
-        grader = fetch_named_object(grader, 'grader', 'grader.py')
+        reference = fetch_named_object(reference_code, name, 'reference.py',
+                                       cache=True,
+                                       artifact=artifacts.get('reference'))
+        grader = fetch_named_object(grader, 'grader', 'grader.py', cache=True,
+                                    artifact=artifacts.get('grader'))
     except FetchObjectError as ex:
         raised = ex.args[0]
         return 'RuntimeError (%s): %s' % (raised.__class__.__name__, raised)
@@ -59,32 +74,77 @@ def get_code_errors(grader, test_code, reference_code, name='func'):
         return '%s: %s' % (ex.__class__.__name__, ex)
 
 
-def fetch_named_object(source, obj_name, file_name='default.py'):
+def fetch_named_object(source, obj_name, file_name='default.py', cache=False,
+                       artifact=None):
     """
     Execute code and return given object.
+
+    Source is registered in the linecache under the given file name so
+    tracebacks can display the offending lines. If cache is True, the compiled
+    code object is reused by subsequent calls with the same source. If a
+    pre-compiled artifact is given, it is used instead of compiling source.
     """
 
     ns = {}
+    linecache.cache[file_name] = (
+        len(source), None, source.splitlines(True), file_name
+    )
 
-    tmp_dir = tempfile.mkdtemp()
-    try:
-        tmp_file = os.path.join(tmp_dir, file_name)
-
-        with open(tmp_file, 'w', encoding='utf8') as F:
-            F.write(source)
+    def get_code():
+        code = load_code(artifact) if artifact else None
+        return code or compile_source(source, file_name)
 
-        try:
-            code = compile(source, tmp_file, 'exec', dont_inherit=True)
-            exec(code, ns)
-        except Exception as ex:
-            raise FetchObjectError(traceback.format_exc())
-    finally:
-        for f in os.listdir(tmp_dir):
-            os.unlink(os.path.join(tmp_dir, f))
-        os.rmdir(tmp_dir)
+    try:
+        if cache:
+            key = content_hash(source, file_name)
+            code = code_cache.get_or_create(key, get_code)
+        else:
+            code = get_code()
+        exec(code, ns)
+    except Exception:
+        raise FetchObjectError(traceback.format_exc())
 
     try:
         return ns[obj_name]
     except KeyError:
         raise FetchObjectError(
             NameError('object %r is not defined' % obj_name))
+
+
+def compile_source(source, file_name='default.py'):
+    """
+    Compile source string into a code object.
+    """
+
+    return compile(source, file_name, 'exec', dont_inherit=True)
+
+
+def dump_code(source, file_name='default.py'):
+    """
+    Compile source and return the marshalled code object as bytes.
+
+    The data is prefixed with the bytecode magic number of the current
+    interpreter. Raises SyntaxError if source is invalid.
+    """
+
+    code = compile_source(source, file_name)
+    return importlib.util.MAGIC_NUMBER + marshal.dumps(code)
+
+
+def load_code(data):
+    """
+    Load code object created by :func:`dump_code`.
+
+    Data can be given as bytes or as a base64 encoded string. Return None if
+    data was created by an incompatible Python interpreter.
+    """
+
+    if isinstance(data, str):
+        data = base64.b64decode(data)
+    magic = importlib.util.MAGIC_NUMBER
+    if not data.startswith(magic):
+        return None
+    try:
+        return marshal.loads(data[len(magic):])
+    except (EOFError, ValueError, TypeError):
+        return None
@@ -32,6 +32,7 @@ such as in the example::
 
 """
 
+import base64
 import logging
 import uuid
 from django.core import validators
@@ -39,11 +40,16 @@ from django.db import models
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
-from .grader import get_code_errors as get_code_errors_unsafe
+from ejudge_server import sandbox
+from ejudge_server.callbacks import schedule_callback
+from .grader import get_code_errors as get_code_errors_unsafe, dump_code
 from .tasks import autograde_submission
 
 logger = logging.getLogger('question_io')
 
+GRADER_MODULE = 'ejudge_server.question_code.grader'
+TIMEOUT_MESSAGE = _('execution took more than {} seconds')
+
 LANGUAGE_CHOICES = [
     ('python', 'Python 3.x'),
     ('python2', 'Python 2.7'),
@@ -109,6 +115,16 @@ class CodeQuestion(models.Model):
         ),
     )
     is_valid = models.BooleanField(default=bool)
+    grader_bytecode = models.BinaryField(
+        blank=True,
+        editable=False,
+        help_text=_('Compiled grader code (created by .prepare()).'),
+    )
+    reference_bytecode = models.BinaryField(
+        blank=True,
+        editable=False,
+        help_text=_('Compiled reference code (created by .prepare()).'),
+    )
 
     def __str__(self):
         return '%s (%s)' % (self.title, self.uuid)
@@ -116,6 +132,41 @@ class CodeQuestion(models.Model):
     def __repr__(self):
         return '<CodeQuestion %r (%s)>' % (self.title, self.uuid)
 
+    def save(self, *args, **kwargs):
+        self.prepare()
+        super().save(*args, **kwargs)
+
+    def prepare(self):
+        """
+        Validate and compile the grader and reference sources.
+
+        Sets the is_valid attribute as a side effect.
+        """
+
+        try:
+            self.grader_bytecode = dump_code(self.grader, 'grader.py')
+            self.reference_bytecode = dump_code(self.reference,
+                                                'reference.py')
+        except SyntaxError as ex:
+            logger.info('invalid question %s: %s' % (self, ex))
+            self.grader_bytecode = self.reference_bytecode = b''
+            self.is_valid = False
+        else:
+            self.is_valid = True
+
+    def get_artifacts(self):
+        """
+        Return a mapping with the base64 encoded pre-compiled grader and
+        reference code that can be passed to :func:`get_code_errors`.
+        """
+
+        return {
+            name: base64.b64encode(bytes(data)).decode('ascii')
+            for name, data in [('grader', self.grader_bytecode),
+                               ('reference', self.reference_bytecode)]
+            if data
+        }
+
 
 class CodeSubmission(models.Model):
     """
@@ -143,6 +194,13 @@ class CodeSubmission(models.Model):
         editable=False,
         default=bool,
     )
+    callback_url = models.URLField(
+        max_length=500,
+        blank=True,
+        help_text=(
+            'If given, feedback is POSTed to this url after grading.'
+        )
+    )
 
     def __str__(self):
         return '%s (%s/%s)' % (self.uuid, self.question.title, self.language)
@@ -162,22 +220,33 @@ class CodeSubmission(models.Model):
         Grade submission and return a CodeFeedback instance.
         """
 
-        get_code_errors(...)
         logger.info('grading submission: %s (%s)' % (self, self.question))
 
-        grade, feedback_data = self._grade_submission(
-            self.question.iospec_template,
+        question = self.question
+        error = get_code_errors(
+            question.grader,
             self.source,
-            self.language
+            question.reference,
+            question.function_name,
+            timeout=question.timeout,
+            artifacts=question.get_artifacts(),
         )
+        grade = 100 if error is None else 0
         feedback = CodeFeedback(
-            grade=grade, submission=self, feedback_data=feedback_data
+            grade=grade, submission=self, error_message=error or ''
         )
         self.has_feedback = True
 
         if commit:
             feedback.save()
             self.save(update_fields=['has_feedback'])
+            schedule_callback(self.callback_url, {
+                'uuid': str(self.pk),
+                'question': str(self.question_id),
+                'has_feedback': True,
+                'grade': float(feedback.grade),
+                'error_message': feedback.error_message,
+            })
         return feedback
 
 
@@ -209,12 +278,14 @@ class CodeFeedback(models.Model):
 
 
 def get_code_errors(grader, code, reference, name, use_sandbox=True,
-                    timeout=5.0):
+                    timeout=5.0, artifacts=None):
     """
     Return an error message for any defects encountered on the given string
     of python code.
 
-    This code can run in a sandbox.
+    This code can run in a sandbox. Sandboxed calls are executed by a pool of
+    warm workers that already imported the grader module. Workers that time
+    out or crash are replaced by new ones.
 
     Args:
         grader (str):
@@ -229,22 +300,31 @@ def get_code_errors(grader, code, reference, name, use_sandbox=True,
             If True, execute code in a sandbox.
         timeout (float):
             Execution timeout (only works in sandboxed mode).
+        artifacts (dict):
+            Pre-compiled grader and reference code as returned by
+            :meth:`CodeQuestion.get_artifacts`.
 
     Returns:
         A string describing an error or None if the codes executed successfully.
     """
 
-    args = (grader, code, reference, name)
-    runner = lambda f, args, **kwargs: f(*args)
+    args = (grader, code, reference, name, artifacts)
+    if not use_sandbox:
+        return get_code_errors_unsafe(*args)
 
-    if use_sandbox:
+    def fallback():
         import boxed
 
-        runner = boxed.run
-
-    return \
-        runner(get_code_errors_unsafe,
-               args=args,
-               serializer='json',
-               timeout=timeout,
-               imports=['ejudge_server.question_code.grader'])
+        return boxed.run(get_code_errors_unsafe,
+                         args=args,
+                         serializer='json',
+                         timeout=timeout,
+                         imports=[GRADER_MODULE])
+
+    try:
+        return sandbox.call('code', get_code_errors_unsafe, args,
+                            imports=[GRADER_MODULE],
+                            timeout=timeout,
+                            fallback=fallback)
+    except sandbox.SandboxTimeoutError:
+        return 'TimeoutError: %s' % TIMEOUT_MESSAGE.format(timeout)
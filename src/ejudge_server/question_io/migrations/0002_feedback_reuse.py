@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def compute_source_hashes(apps, schema_editor):
+    IoSubmission = apps.get_model('question_io', 'IoSubmission')
+    for submission in IoSubmission.objects.only('source').iterator():
+        lines = [line.rstrip() for line in submission.source.splitlines()]
+        normalized = '\n'.join(lines).strip('\n')
+        digest = hashlib.sha1(normalized.encode('utf8') + b'\0').hexdigest()
+        IoSubmission.objects \
+            .filter(pk=submission.pk) \
+            .update(source_hash=digest)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('question_io', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='iofeedback',
+            name='iospec_hash',
+            field=models.CharField(blank=True, editable=False, help_text='Hash of the iospec used to compute this feedback.', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='iosubmission',
+            name='source_hash',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Hash of the normalized source code. Used to find identical submissions.', max_length=40),
+            preserve_default=False,
+        ),
+        migrations.AlterIndexTogether(
+            name='iosubmission',
+            index_together=set([('question', 'language', 'source_hash')]),
+        ),
+        migrations.RunPython(compute_source_hashes, migrations.RunPython.noop),
+    ]
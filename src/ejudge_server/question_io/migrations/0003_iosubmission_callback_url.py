@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('question_io', '0002_feedback_reuse'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='iosubmission',
+            name='callback_url',
+            field=models.URLField(blank=True, help_text='If given, feedback is POSTed to this url after grading.', max_length=500),
+        ),
+    ]
@@ -4,11 +4,18 @@ import uuid
 from django.core import validators
 from django.db import models
 from django.utils.safestring import mark_safe
-from .tasks import expand_question_iospec, autograde_submission
-from .utils import iospec_expand, grade_submission
+from ejudge_server.cache import HitCounter, content_hash
+from ejudge_server.callbacks import schedule_callback
+from ejudge_server.notify import publish_feedback
+from .tasks import expand_question_iospec, submission_batcher
+from .utils import iospec_expand, grade_submission, invalidate_iospec, \
+    source_hash
 
 logger = logging.getLogger('question_io')
 
+# Counts how many submissions reused the feedback of an identical submission
+feedback_reuse = HitCounter()
+
 LANGUAGE_CHOICES = [
     ('python', 'Python 3.x'),
     ('python2', 'Python 2.7'),
@@ -71,6 +78,10 @@ class IoQuestion(models.Model):
     )
     is_valid = models.BooleanField(default=bool)
 
+    # Field values as loaded from/saved to the database
+    _loaded_values = {}
+    _tracked_fields = ('iospec_template', 'iospec', 'source', 'language')
+
     def __str__(self):
         return '%s (%s)' % (self.title, self.uuid)
 
@@ -79,8 +90,35 @@ class IoQuestion(models.Model):
 
     _iospec_expand = staticmethod(iospec_expand)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            f: v for f, v in zip(field_names, values)
+            if f in cls._tracked_fields
+        }
+        return instance
+
+    @property
+    def grading_iospec(self):
+        """
+        The iospec source used to grade submissions.
+
+        This is the expanded iospec, if available, or the iospec template
+        otherwise.
+        """
+
+        if self.is_valid and self.iospec:
+            return self.iospec
+        return self.iospec_template
+
     def save(self, schedule=True, **kwargs):
+        # A new template or reference program invalidates the expansion
+        if self._changed_fields('iospec_template', 'source', 'language'):
+            self.iospec = ''
+            self.is_valid = False
         super().save(**kwargs)
+        self._refresh_loaded_values()
         if schedule and not self.iospec:
             expand_question_iospec.delay(self.pk)
 
@@ -101,6 +139,21 @@ class IoQuestion(models.Model):
         pprint(self.__dict__)
         if commit:
             super().save()
+            self._refresh_loaded_values()
+
+    def _changed_fields(self, *fields):
+        loaded = self._loaded_values
+        return [f for f in fields
+                if f in loaded and loaded[f] != getattr(self, f)]
+
+    def _refresh_loaded_values(self):
+        # Evict parsed versions of the old template/iospec from the cache
+        changed = self._changed_fields('iospec_template', 'iospec')
+        invalidate_iospec(*(self._loaded_values[f] for f in changed))
+        self._loaded_values = {
+            f: getattr(self, f) for f in self._tracked_fields
+            if f in self.__dict__
+        }
 
 
 class IoSubmission(models.Model):
@@ -136,6 +189,25 @@ class IoSubmission(models.Model):
         editable=False,
         default=bool,
     )
+    source_hash = models.CharField(
+        max_length=40,
+        blank=True,
+        editable=False,
+        help_text=(
+            'Hash of the normalized source code. Used to find identical '
+            'submissions.'
+        )
+    )
+    callback_url = models.URLField(
+        max_length=500,
+        blank=True,
+        help_text=(
+            'If given, feedback is POSTed to this url after grading.'
+        )
+    )
+
+    class Meta:
+        index_together = [('question', 'language', 'source_hash')]
 
     def __str__(self):
         return '%s (%s/%s)' % (self.uuid, self.question.title, self.language)
@@ -149,9 +221,10 @@ class IoSubmission(models.Model):
     _grade_submission = staticmethod(grade_submission)
 
     def save(self, schedule=True, **kwargs):
+        self.source_hash = source_hash(self.source)
         super().save(**kwargs)
         if schedule and not self.has_feedback:
-            autograde_submission.delay(self.pk)
+            submission_batcher.add(self.question_id, self.pk)
 
     def feedback_auto(self, commit=True):
         """
@@ -160,19 +233,70 @@ class IoSubmission(models.Model):
 
         logger.info('grading submission: %s (%s)' % (self, self.question))
 
-        grade, feedback_data = self._grade_submission(
-            self.question.iospec_template,
-            self.source,
-            self.language
-        )
+        if not self.question.is_valid:
+            logger.warning('grading with unexpanded iospec template: %s' %
+                           self.question)
+
+        iospec = self.question.grading_iospec
+        iospec_hash = content_hash(iospec)
+        cached = None
+        if not self._state.adding:
+            cached = self.find_identical_feedback(iospec_hash)
+        if cached is not None:
+            logger.info('reusing feedback from %s' % cached.submission_id)
+            grade, feedback_data = cached.grade, cached.feedback_data
+        else:
+            grade, feedback_data = self._grade_submission(
+                iospec,
+                self.source,
+                self.language
+            )
         feedback = IoFeedback(
-            grade=grade, submission=self, feedback_data=feedback_data
+            grade=grade, submission=self, feedback_data=feedback_data,
+            iospec_hash=iospec_hash,
         )
         self.has_feedback = True
 
         if commit:
             feedback.save()
             self.save(update_fields=['has_feedback'])
+            publish_feedback([self.pk])
+            self.schedule_callback(feedback)
+        return feedback
+
+    def schedule_callback(self, feedback):
+        """
+        Schedule delivery of feedback to the submission's callback url.
+        """
+
+        schedule_callback(self.callback_url, {
+            'uuid': str(self.pk),
+            'question': str(self.question_id),
+            'has_feedback': True,
+            'grade': float(feedback.grade),
+            'feedback_data': feedback.feedback_data,
+        })
+
+    def find_identical_feedback(self, iospec_hash):
+        """
+        Return the feedback of an identical submission to the same question
+        graded against the iospec with the given hash, or None if no such
+        feedback exists.
+        """
+
+        if not self.source_hash:
+            self.source_hash = source_hash(self.source)
+        feedback = IoFeedback.objects \
+            .filter(submission__question_id=self.question_id,
+                    submission__language=self.language,
+                    submission__source_hash=self.source_hash,
+                    iospec_hash=iospec_hash) \
+            .exclude(submission_id=self.pk) \
+            .first()
+        if feedback is None:
+            feedback_reuse.miss()
+        else:
+            feedback_reuse.hit()
         return feedback
 
 
@@ -193,3 +317,11 @@ class IoFeedback(models.Model):
             validators.MaxValueValidator(100),
         ])
     feedback_data = jsonfield.JSONField()
+    iospec_hash = models.CharField(
+        max_length=40,
+        blank=True,
+        editable=False,
+        help_text=(
+            'Hash of the iospec used to compute this feedback.'
+        )
+    )
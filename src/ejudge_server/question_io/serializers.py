@@ -1,7 +1,14 @@
+import re
+
 from rest_framework import serializers
 
 from ejudge_server.utils import full_url
-from .models import IoQuestion, IoSubmission
+from .models import IoQuestion, IoSubmission, LANGUAGE_CHOICES
+
+UUID_REGEX = re.compile(
+    r'[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}',
+    re.IGNORECASE
+)
 
 
 class IoQuestionSerializer(serializers.HyperlinkedModelSerializer):
@@ -42,7 +49,7 @@ class IoSubmissionSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = IoSubmission
         fields = ('url', 'uuid', 'question', 'source', 'language', 'grade',
-                  'resources')
+                  'callback_url', 'resources')
 
     def get_resources(self, obj):
         base_url = full_url('api/io/submissions/%s/' % obj.uuid)
@@ -54,6 +61,27 @@ class IoSubmissionSerializer(serializers.HyperlinkedModelSerializer):
         return obj.feedback.grade if obj.has_feedback else None
 
 
+class IoSubmissionBulkSerializer(serializers.Serializer):
+    """
+    Serializer for items of the /io/submissions/bulk/ endpoint.
+
+    Questions can be given either by url or by uuid. They are not fetched from
+    the database during validation.
+    """
+
+    uuid = serializers.UUIDField(required=False)
+    question = serializers.CharField()
+    source = serializers.CharField()
+    language = serializers.ChoiceField(LANGUAGE_CHOICES)
+    callback_url = serializers.URLField(max_length=500, required=False)
+
+    def validate_question(self, value):
+        match = UUID_REGEX.search(value)
+        if match is None:
+            raise serializers.ValidationError('invalid question: %r' % value)
+        return match.group(0).lower()
+
+
 class IoSubmissionFeedbackSerializer(serializers.Serializer):
     """
     Serializer for the /io/submissions/{id}/feedback/ endpoint.
@@ -1,8 +1,19 @@
 from celery import shared_task
 from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import transaction
+
+from ejudge_server.batching import Batcher
+from ejudge_server.callbacks import callback_batcher
+from ejudge_server.notify import publish_feedback
 
 logger = get_task_logger(__name__)
 
+# Submissions to questions that were not expanded yet are re-scheduled every
+# EXPANSION_WAIT seconds, at most EXPANSION_MAX_WAITS times.
+EXPANSION_WAIT = getattr(settings, 'EJUDGE_EXPANSION_WAIT', 2.0)
+EXPANSION_MAX_WAITS = getattr(settings, 'EJUDGE_EXPANSION_MAX_WAITS', 30)
+
 
 @shared_task
 def expand_question_iospec(question_pk):
@@ -14,15 +25,128 @@ def expand_question_iospec(question_pk):
     from ejudge_server.question_io.models import IoQuestion
 
     question = IoQuestion.objects.get(pk=question_pk)
-    question.expand_inplace()
+    if not question.is_valid:
+        question.expand_inplace()
 
 
-@shared_task
-def autograde_submission(submission_pk):
+@shared_task(bind=True)
+def autograde_submission(self, submission_pk):
     """
     Grade submission.
+
+    If the question was not expanded yet, wait for the expansion task to
+    finish instead of grading against the raw iospec template.
     """
     from ejudge_server.question_io.models import IoSubmission
 
-    submission = IoSubmission.objects.get(pk=submission_pk)
+    submission = IoSubmission.objects \
+        .select_related('question') \
+        .get(pk=submission_pk)
+
+    if not submission.question.is_valid:
+        if self.request.retries < EXPANSION_MAX_WAITS:
+            logger.info('waiting expansion of %s' % submission.question)
+            raise self.retry(countdown=EXPANSION_WAIT,
+                             max_retries=EXPANSION_MAX_WAITS)
     submission.feedback_auto()
+
+
+
+@shared_task(bind=True)
+def autograde_submissions(self, submission_pks):
+    """
+    Grade many submissions in a single task.
+
+    Submissions to the same question share the question instance and the
+    parsed iospec. Feedback is saved with a single bulk insert. Submissions to
+    questions that were not expanded yet are re-scheduled in a new batch.
+    """
+    from ejudge_server.question_io.models import IoSubmission, IoFeedback, \
+        feedback_reuse
+
+    submissions = IoSubmission.objects \
+        .select_related('question') \
+        .filter(pk__in=submission_pks, has_feedback=False) \
+        .order_by('question')
+
+    questions = {}
+    ready, waiting = [], []
+    for submission in submissions:
+        question = questions.setdefault(submission.question_id,
+                                        submission.question)
+        submission.question = question
+        if question.is_valid or self.request.retries >= EXPANSION_MAX_WAITS:
+            ready.append(submission)
+        else:
+            waiting.append(submission.pk)
+
+    # Identical submissions in the same batch are graded only once
+    feedbacks = []
+    graded = {}
+    for submission in ready:
+        key = (submission.question_id, submission.language,
+               submission.source_hash)
+        if key in graded:
+            feedback_reuse.hit()
+            first = graded[key]
+            feedbacks.append(IoFeedback(
+                submission=submission,
+                grade=first.grade,
+                feedback_data=first.feedback_data,
+                iospec_hash=first.iospec_hash,
+            ))
+            continue
+        try:
+            feedback = graded[key] = submission.feedback_auto(commit=False)
+            feedbacks.append(feedback)
+        except Exception:
+            logger.exception('error grading submission %s' % submission.pk)
+
+    with transaction.atomic():
+        IoFeedback.objects.bulk_create(feedbacks)
+        IoSubmission.objects \
+            .filter(pk__in=[fb.submission_id for fb in feedbacks]) \
+            .update(has_feedback=True)
+    publish_feedback([fb.submission_id for fb in feedbacks])
+    for feedback in feedbacks:
+        feedback.submission.schedule_callback(feedback)
+    callback_batcher.flush()
+    logger.info('graded %s submissions' % len(feedbacks))
+
+    if waiting:
+        logger.info('waiting expansion of %s submissions' % len(waiting))
+        raise self.retry(args=([str(pk) for pk in waiting],),
+                         countdown=EXPANSION_WAIT,
+                         max_retries=EXPANSION_MAX_WAITS)
+
+
+def schedule_grading(submissions):
+    """
+    Enqueue grading of many submissions at once.
+
+    Submissions are grouped by question in autograde_submissions tasks with at
+    most EJUDGE_BATCH_SIZE submissions each.
+    """
+
+    by_question = {}
+    for submission in submissions:
+        by_question.setdefault(submission.question_id, []).append(
+            str(submission.pk))
+
+    size = submission_batcher.max_size
+    for pks in by_question.values():
+        for i in range(0, len(pks), size):
+            autograde_submissions.delay(pks[i:i + size])
+
+
+def _flush_submissions(question_pk, submission_pks):
+    autograde_submissions.delay([str(pk) for pk in submission_pks])
+
+
+# Collects submissions to the same question in a short time window and grade
+# them together in a single autograde_submissions task.
+submission_batcher = Batcher(
+    _flush_submissions,
+    window=getattr(settings, 'EJUDGE_BATCH_WINDOW', 0.5),
+    max_size=getattr(settings, 'EJUDGE_BATCH_SIZE', 50),
+)
@@ -1,9 +1,48 @@
 import ejudge
+from django.conf import settings
 from iospec import parse as parse_iospec
 
+from ejudge_server.cache import LRUCache, content_hash
+
 # Can be mocked to False during tests
 SANDBOX = True
 
+# Parsed iospec trees shared by all gradings in the current worker process
+iospec_cache = LRUCache(getattr(settings, 'EJUDGE_IOSPEC_CACHE_SIZE', 256))
+
+
+def parse_iospec_cached(iospec: str):
+    """
+    Parse iospec source reusing previously parsed trees with the same content.
+
+    The resulting object is shared between callers and must not be modified
+    inplace. Make a copy before calling methods such as .expand_inputs().
+    """
+
+    key = content_hash(iospec)
+    return iospec_cache.get_or_create(key, lambda: parse_iospec(iospec))
+
+
+def source_hash(source: str):
+    """
+    Return a hash of the normalized source code.
+
+    Normalization removes trailing whitespace, blank lines at the beginning and
+    at the end of the source and converts all line endings to "\\n".
+    """
+
+    lines = [line.rstrip() for line in source.splitlines()]
+    return content_hash('\n'.join(lines).strip('\n'))
+
+
+def invalidate_iospec(*iospecs):
+    """
+    Discard the parsed trees for the given iospec sources from cache.
+    """
+
+    for iospec in iospecs:
+        iospec_cache.discard(content_hash(iospec))
+
 
 def iospec_expand(iospec: str, source: str, language: str):
     """
@@ -21,7 +60,7 @@ def iospec_expand(iospec: str, source: str, language: str):
         An expanded iospec data.
     """
 
-    iospec_ = parse_iospec(iospec)
+    iospec_ = parse_iospec_cached(iospec)
     results = ejudge.run(source, iospec_, lang=language, sandbox=SANDBOX)
     return results.source()
 
@@ -45,7 +84,7 @@ def grade_submission(iospec: str, source: str, language: str):
             A JSON representation with the complete feedback.
     """
 
-    iospec_ = parse_iospec(iospec)
+    iospec_ = parse_iospec_cached(iospec)
     results = ejudge.grade(source, iospec_, lang=language, sandbox=SANDBOX)
     grade = results.grade * 100
     return (grade, results.to_json())
@@ -1,11 +1,74 @@
-from rest_framework import viewsets
+import uuid
+
+from django.db import transaction
+from rest_framework import viewsets, status
+from rest_framework.decorators import list_route
+from rest_framework.exceptions import ValidationError, NotFound
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.routers import APIRootView
 
+from ejudge_server.notify import wait_feedback
+from ejudge_server.parsers import NDJSONParser
+from ejudge_server.utils import request_wait, wait_result
 from .models import IoQuestion, IoSubmission
 from .serializers import \
     IoQuestionSerializer, IoSubmissionSerializer, IoQuestionExpansionSerializer, \
-    IoSubmissionFeedbackSerializer
+    IoSubmissionFeedbackSerializer, IoSubmissionBulkSerializer
+from .tasks import schedule_grading, expand_question_iospec, \
+    autograde_submission
+from .utils import source_hash
+
+
+# Maximum number of submissions in a single ?uuid=... feedback query
+MAX_FEEDBACK_QUERY = 100
+
+
+# ------------------------------------------------------------------------------
+# Helpers
+#
+def accepted_response(request, data, result):
+    """
+    Return a 202 Accepted response for work scheduled in the given celery
+    task.
+
+    The Location header points to the resource that should be polled for the
+    results.
+    """
+
+    data = dict(data, status='pending', task=result.id)
+    location = request.build_absolute_uri(request.path)
+    return Response(data, status=status.HTTP_202_ACCEPTED,
+                    headers={'Location': location})
+
+
+def feedback_data(submission):
+    """
+    Return the feedback representation of the given submission.
+    """
+
+    if submission.has_feedback:
+        grade = submission.feedback.grade
+        feedback_data = submission.feedback.feedback_data
+    else:
+        grade = feedback_data = None
+
+    return {
+        'has_feedback': submission.has_feedback,
+        'grade': grade,
+        'feedback_data': feedback_data,
+    }
+
+
+def graded_submissions(submission_pks):
+    """
+    Return the uuids of the given submissions that already have feedback.
+    """
+
+    return IoSubmission.objects \
+        .filter(pk__in=submission_pks, has_feedback=True) \
+        .values_list('pk', flat=True)
 
 
 # ------------------------------------------------------------------------------
@@ -28,7 +91,8 @@ class QuestionIoViewSet(viewsets.ModelViewSet):
 class QuestionExpansionViewSet(viewsets.ModelViewSet):
     """
     GET - return the status of the iospec expansion
-    PUT - forces iospec expansion to happen
+    PUT - schedules iospec expansion and return 202 Accepted. Use ?wait=<secs>
+          to block until expansion finishes (returns 200 OK).
     """
 
     queryset = IoQuestion.objects.all()
@@ -45,13 +109,27 @@ class QuestionExpansionViewSet(viewsets.ModelViewSet):
 
     def update(self, request, pk=None):
         obj = self.get_object()
+        serializer = IoQuestionExpansionSerializer(data=request.data,
+                                                   partial=True)
+        serializer.is_valid(raise_exception=True)
         num_expansions = \
-            request.data.get('num_expansions') or obj.num_expansions
+            serializer.validated_data.get('num_expansions') or \
+            obj.num_expansions
 
-        if not obj.is_valid or obj.num_expansions != num_expansions:
-            obj.expand_inplace()
+        if obj.is_valid and obj.num_expansions == num_expansions:
+            return Response(self.retrieve_data(obj))
 
-        return self.retrieve_data(obj)
+        if obj.num_expansions != num_expansions:
+            obj.num_expansions = num_expansions
+            obj.is_valid = False
+            obj.save(schedule=False)
+
+        result = expand_question_iospec.delay(str(obj.pk))
+        if wait_result(result, request_wait(request)):
+            obj.refresh_from_db()
+            if obj.is_valid:
+                return Response(self.retrieve_data(obj))
+        return accepted_response(request, self.retrieve_data(obj), result)
 
 
 # ------------------------------------------------------------------------------
@@ -67,42 +145,141 @@ class SubmissionIoViewSet(viewsets.ModelViewSet):
     graded feedback to the submission.
     """
 
-    queryset = IoSubmission.objects.all()
+    queryset = IoSubmission.objects.select_related('feedback')
     serializer_class = IoSubmissionSerializer
 
+    @list_route(methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        Create many submissions at once.
+
+        Accepts a JSON array or a NDJSON stream of submissions. Questions can
+        be referenced by url or by uuid. Return a list with the uuid and url of
+        each new submission.
+        """
+
+        if not isinstance(request.data, list):
+            raise ValidationError('expected a list of submissions')
+        serializer = IoSubmissionBulkSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data
+
+        questions = {str(pk) for pk in IoQuestion.objects
+                     .filter(pk__in={item['question'] for item in items})
+                     .values_list('pk', flat=True)}
+        missing = {item['question'] for item in items} - questions
+        if missing:
+            raise ValidationError({
+                'question': ['question does not exist: %s' % pk
+                             for pk in sorted(missing)]
+            })
+
+        submissions = []
+        for item in items:
+            submission = IoSubmission(
+                question_id=item['question'],
+                source=item['source'],
+                language=item['language'],
+                source_hash=source_hash(item['source']),
+                callback_url=item.get('callback_url', ''),
+            )
+            if 'uuid' in item:
+                submission.uuid = item['uuid']
+            submissions.append(submission)
+
+        with transaction.atomic():
+            IoSubmission.objects.bulk_create(submissions)
+        schedule_grading(submissions)
+
+        data = [{
+            'uuid': str(submission.uuid),
+            'url': reverse('iosubmission-detail', args=[submission.uuid],
+                           request=request),
+        } for submission in submissions]
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @list_route(methods=['get'])
+    def feedback(self, request):
+        """
+        Return the feedback of several submissions.
+
+        Submissions are given as ?uuid=<uuid1>,<uuid2>,... Use ?wait=<secs> to
+        block until all submissions are graded or the timeout expires.
+        """
+
+        pks = []
+        for value in request.query_params.getlist('uuid'):
+            for pk in filter(None, value.split(',')):
+                try:
+                    pks.append(str(uuid.UUID(pk)))
+                except ValueError:
+                    raise ValidationError({'uuid': ['invalid uuid: %s' % pk]})
+        if not pks:
+            raise ValidationError({'uuid': ['no submission was given']})
+        if len(pks) > MAX_FEEDBACK_QUERY:
+            raise ValidationError({
+                'uuid': ['at most %s submissions are allowed' %
+                         MAX_FEEDBACK_QUERY]
+            })
+
+        submissions = {str(obj.pk): obj
+                       for obj in self.get_queryset().filter(pk__in=pks)}
+        missing = [pk for pk in pks if pk not in submissions]
+        if missing:
+            raise NotFound('submissions not found: %s' % ', '.join(missing))
+
+        pending = [pk for pk, obj in submissions.items() if not obj.has_feedback]
+        wait = request_wait(request)
+        if pending and wait:
+            if wait_feedback(pending, wait, graded_submissions):
+                submissions.update(
+                    (str(obj.pk), obj)
+                    for obj in self.get_queryset().filter(pk__in=pending))
+
+        results = [dict(feedback_data(submissions[pk]), uuid=pk)
+                   for pk in pks]
+        return Response({
+            'pending': [item['uuid'] for item in results
+                        if not item['has_feedback']],
+            'results': results,
+        })
+
 
 class SubmissionFeedbackViewSet(viewsets.ModelViewSet):
     """
     Information about the feedback of a submission.
 
-    GET - retrieves information of the feedback
-    PUT - forces feedback to be calculated.
+    GET - retrieves information of the feedback. Use ?wait=<secs> to block
+          until the feedback is available.
+    PUT - schedules grading and return 202 Accepted. Use ?wait=<secs> to block
+          until the feedback is available (returns 200 OK).
     """
 
-    queryset = IoSubmission.objects.all()
+    queryset = IoSubmission.objects.select_related('feedback')
     serializer_class = IoSubmissionFeedbackSerializer
 
     def retrieve_data(self, instance):
-        if instance.has_feedback:
-            grade = instance.feedback.grade
-            feedback_data = instance.feedback.feedback_data
-        else:
-            grade = feedback_data = None
-
-        return {
-            'has_feedback': instance.has_feedback,
-            'grade': grade,
-            'feedback_data': feedback_data,
-        }
+        return feedback_data(instance)
 
     def retrieve(self, request, *args, **kwargs):
-        return Response(self.retrieve_data(self.get_object()))
+        instance = self.get_object()
+        wait = request_wait(request)
+        if not instance.has_feedback and wait:
+            if wait_feedback([instance.pk], wait, graded_submissions):
+                instance = self.get_object()
+        return Response(self.retrieve_data(instance))
 
     def update(self, request, pk=None):
         instance = self.get_object()
-        if not instance.has_feedback:
-            instance.feedback_auto()
-        return self.retrieve_data(instance)
+        if instance.has_feedback:
+            return Response(self.retrieve_data(instance))
+
+        result = autograde_submission.delay(str(instance.pk))
+        if wait_result(result, request_wait(request)):
+            instance = self.get_object()
+            if instance.has_feedback:
+                return Response(self.retrieve_data(instance))
+        return accepted_response(request, self.retrieve_data(instance), result)
 
 
 # ------------------------------------------------------------------------------
@@ -0,0 +1,428 @@
+"""
+Pools of warm sandboxed interpreters.
+
+Each boxed.run() call starts a new sandboxed Python interpreter that has to
+import ejudge (and the language support modules) before doing any real work.
+This module keeps a few of these interpreters alive and reuses them across
+runs.
+
+A worker is started with the EJUDGE_SANDBOX_COMMAND command (the default runs
+the sandbox_worker module with the setuid ``python_boxed`` interpreter used by
+boxed). The
+parent sends a JSON header with a list of modules to pre-import and the user
+that should own the process. After that, the worker drops its privileges and
+executes one JSON request per line::
+
+    {"target": "ejudge.functions.run_worker", "args": [...], "kwargs": {...}}
+
+Workers are recycled after EJUDGE_SANDBOX_MAX_RUNS runs, when their memory
+grows beyond EJUDGE_SANDBOX_MAX_MEMORY megabytes, and after any crash or
+timeout. Set EJUDGE_SANDBOX_POOL_SIZE to 0 to spawn a new sandbox for each run.
+"""
+
+import json
+import logging
+import os
+import queue
+import select
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger('ejudge_server.sandbox')
+
+DEFAULT_COMMAND = ['python_boxed', '-S', '-s', '-m',
+                   'ejudge_server.sandbox_worker']
+
+
+class SandboxError(Exception):
+    """
+    Raised when a sandboxed worker crashes or cannot be started.
+    """
+
+
+class SandboxTimeoutError(SandboxError, TimeoutError):
+    """
+    Raised when a sandboxed call exceeds its timeout.
+    """
+
+
+class SandboxCallError(Exception):
+    """
+    Raised when the target function raises an exception inside the sandbox.
+    """
+
+    def __init__(self, error, message, traceback=None):
+        super().__init__('%s: %s' % (error, message))
+        self.error = error
+        self.message = message
+        self.traceback = traceback
+
+
+def setting(name, default=None):
+    """
+    Return the value of an EJUDGE_SANDBOX_<name> Django setting.
+    """
+
+    from django.conf import settings
+
+    return getattr(settings, 'EJUDGE_SANDBOX_' + name, default)
+
+
+def target_name(target):
+    """
+    Return the dotted name of a function.
+    """
+
+    if isinstance(target, str):
+        return target
+    return '%s.%s' % (target.__module__, target.__qualname__)
+
+
+# ------------------------------------------------------------------------------
+# Parent side
+#
+class SandboxWorker:
+    """
+    A persistent sandboxed interpreter that executes functions on request.
+
+    Args:
+        imports (list):
+            List of modules imported before the worker drops its privileges.
+            Only functions defined in these modules can be called.
+        command (list):
+            Command used to start the worker interpreter.
+        user (str):
+            Unprivileged user that owns the worker process. If None, keep the
+            current user.
+    """
+
+    def __init__(self, imports, command=None, user='nobody'):
+        self.imports = list(imports)
+        self.command = list(command or DEFAULT_COMMAND)
+        self.user = user
+        self.runs = 0
+        self.process = None
+        self._buffer = b''
+
+    @property
+    def pid(self):
+        return self.process and self.process.pid
+
+    @property
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, timeout=30):
+        """
+        Start worker process and wait until it is ready.
+        """
+
+        try:
+            self.process = subprocess.Popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+        except OSError as ex:
+            raise SandboxError('could not start sandbox: %s' % ex)
+        self._send({'imports': self.imports, 'user': self.user})
+        try:
+            response = self._recv(timeout)
+        except SandboxError:
+            self.close()
+            raise
+        if response.get('status') != 'ready':
+            self.close()
+            raise SandboxError('sandbox failed to start: %r' % response)
+        logger.debug('sandbox worker %s started' % self.pid)
+
+    def call(self, target, args=(), kwargs=None, timeout=None):
+        """
+        Call target(*args, **kwargs) inside the sandbox and return the result.
+
+        The worker is killed if the call takes longer than timeout seconds.
+        """
+
+        self.runs += 1
+        self._send({
+            'target': target_name(target),
+            'args': list(args),
+            'kwargs': kwargs or {},
+        })
+        try:
+            response = self._recv(timeout)
+        except SandboxError:
+            self.close()
+            raise
+
+        if response['status'] == 'ok':
+            return response['result']
+        raise SandboxCallError(response['error'], response['message'],
+                               response.get('traceback'))
+
+    def memory(self):
+        """
+        Resident memory of the worker process (in bytes) or None if it cannot
+        be determined.
+        """
+
+        try:
+            import psutil
+
+            return psutil.Process(self.pid).memory_info().rss
+        except Exception:
+            return None
+
+    def close(self):
+        """
+        Terminate worker process.
+        """
+
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+            self.process.stdin.close()
+            self.process.stdout.close()
+            logger.debug('sandbox worker %s closed' % self.pid)
+
+    def _send(self, data):
+        try:
+            self.process.stdin.write(json.dumps(data).encode('utf8') + b'\n')
+            self.process.stdin.flush()
+        except (OSError, ValueError) as ex:
+            self.close()
+            raise SandboxError('sandbox worker died: %s' % ex)
+
+    def _recv(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        fd = self.process.stdout.fileno()
+
+        while b'\n' not in self._buffer:
+            wait = None if deadline is None else deadline - time.monotonic()
+            if wait is not None and wait <= 0:
+                raise SandboxTimeoutError('sandbox timed out after %ss' %
+                                          timeout)
+            ready, _, _ = select.select([fd], [], [], wait)
+            if ready:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise SandboxError('sandbox worker %s crashed' % self.pid)
+                self._buffer += chunk
+
+        line, _, self._buffer = self._buffer.partition(b'\n')
+        return json.loads(line.decode('utf8'))
+
+
+class SandboxPool:
+    """
+    A pool of warm sandboxed workers that share the same pre-imported modules.
+
+    Args:
+        imports (list):
+            Modules pre-imported by all workers.
+        size (int):
+            Maximum number of simultaneous workers.
+        max_runs (int):
+            Recycle worker after the given number of runs.
+        max_memory (float):
+            Recycle worker when its resident memory exceeds the given value
+            (in megabytes).
+        command, user:
+            Passed to :class:`SandboxWorker`.
+    """
+
+    def __init__(self, imports, size=2, max_runs=200, max_memory=256,
+                 command=None, user='nobody'):
+        self.imports = list(imports)
+        self.size = size
+        self.max_runs = max_runs
+        self.max_memory = max_memory
+        self.command = command
+        self.user = user
+        self.spawns = self.runs = self.recycles = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._workers = set()
+        self._lock = threading.Lock()
+
+    @property
+    def num_idle(self):
+        """
+        Number of workers that can be used without waiting.
+        """
+
+        return self.size - len(self._workers) + self._idle.qsize()
+
+    def run(self, target, args=(), kwargs=None, timeout=None):
+        """
+        Run target(*args, **kwargs) in one of the workers of the pool.
+        """
+
+        worker = self._acquire()
+        try:
+            result = worker.call(target, args, kwargs, timeout=timeout)
+        except SandboxError:
+            self._discard(worker)
+            raise
+        except BaseException:
+            self._release(worker)
+            raise
+        else:
+            self._release(worker)
+            return result
+
+    def close(self):
+        """
+        Terminate all workers.
+        """
+
+        with self._lock:
+            workers, self._workers = self._workers, set()
+        for worker in workers:
+            worker.close()
+
+    def stats(self):
+        """
+        Return a dictionary with usage statistics.
+        """
+
+        return {
+            'size': self.size,
+            'workers': len(self._workers),
+            'idle': self._idle.qsize(),
+            'spawns': self.spawns,
+            'runs': self.runs,
+            'recycles': self.recycles,
+        }
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._spawn()
+                if worker.is_alive:
+                    return worker
+                self._discard(worker, release=False)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _spawn(self):
+        worker = SandboxWorker(self.imports, self.command, self.user)
+        worker.start()
+        with self._lock:
+            self._workers.add(worker)
+            self.spawns += 1
+        return worker
+
+    def _release(self, worker):
+        self.runs += 1
+        memory = worker.memory() if self.max_memory else None
+        if worker.runs >= self.max_runs or (
+                memory is not None and memory > self.max_memory * 2 ** 20):
+            self.recycles += 1
+            self._discard(worker)
+        else:
+            self._idle.put(worker)
+            self._slots.release()
+
+    def _discard(self, worker, release=True):
+        with self._lock:
+            self._workers.discard(worker)
+        worker.close()
+        if release:
+            self._slots.release()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_unavailable = False
+
+
+def get_pool(name, imports):
+    """
+    Return the pool with the given name, creating it if necessary.
+
+    Pools are configured from the EJUDGE_SANDBOX_* settings. Return None if
+    pools are disabled.
+    """
+
+    size = setting('POOL_SIZE', 2)
+    if size <= 0 or _unavailable:
+        return None
+
+    with _pools_lock:
+        try:
+            return _pools[name]
+        except KeyError:
+            pool = _pools[name] = SandboxPool(
+                imports,
+                size=size,
+                max_runs=setting('MAX_RUNS', 200),
+                max_memory=setting('MAX_MEMORY', 256),
+                command=setting('COMMAND', DEFAULT_COMMAND),
+                user=setting('USER', 'nobody'),
+            )
+            return pool
+
+
+def close_pools():
+    """
+    Terminate all workers of all pools.
+    """
+
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def call(name, target, args=(), kwargs=None, *, imports=(), timeout=None,
+         fallback=None):
+    """
+    Call target(*args, **kwargs) in a worker of the named pool.
+
+    Call fallback() instead if pools are disabled or if the worker interpreter
+    cannot be started.
+    """
+    global _unavailable
+
+    pool = get_pool(name, imports)
+    if pool is not None:
+        try:
+            return pool.run(target, args, kwargs, timeout=timeout)
+        except SandboxError as ex:
+            if pool.spawns or isinstance(ex, SandboxTimeoutError):
+                raise
+            logger.warning('disabling sandbox pools: %s' % ex)
+            _unavailable = True
+
+    if fallback is None:
+        raise SandboxError('sandbox pools are disabled')
+    return fallback()
+
+
+def run_sandbox(target, args=(), kwargs=None, imports=(), **options):
+    """
+    Replacement for :func:`boxed.jsonbox.run` that executes in a warm
+    sandboxed worker whenever possible.
+    """
+
+    from boxed.jsonbox import run
+
+    # ejudge calls run_worker(source, inputs, lang): use one pool per language
+    name = args[2] if len(args) >= 3 else target_name(target)
+    fallback = lambda: run(target, args, kwargs, imports=imports, **options)
+    try:
+        return call(name, target, args, kwargs,
+                    imports=imports,
+                    timeout=setting('TIMEOUT', 60),
+                    fallback=fallback)
+    except SandboxCallError as ex:
+        raise RuntimeError(str(ex))
@@ -0,0 +1,83 @@
+"""
+Worker process of the sandbox pools.
+
+Execute it with ``python -m ejudge_server.sandbox_worker``. See the
+ejudge_server.sandbox module for a description of the protocol.
+"""
+
+import importlib
+import json
+import os
+import sys
+import traceback
+
+
+def serve():
+    """
+    Main loop of the worker process.
+    """
+
+    # Keep private copies of the standard streams for the communication with
+    # the parent. Code executed in the worker cannot read or write on them.
+    proto_in = os.fdopen(os.dup(0), 'rb')
+    proto_out = os.fdopen(os.dup(1), 'wb')
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(2, 1)
+
+    def send(data):
+        proto_out.write(json.dumps(data).encode('utf8') + b'\n')
+        proto_out.flush()
+
+    header = json.loads(proto_in.readline().decode('utf8'))
+    imports = header['imports']
+    for mod in imports:
+        importlib.import_module(mod)
+
+    # Pre-loaded modules may use lazy translations and other features that
+    # require a configured Django instance
+    if os.environ.get('DJANGO_SETTINGS_MODULE'):
+        import django
+
+        django.setup()
+
+    if header.get('user'):
+        _lower_privileges(header['user'])
+    send({'status': 'ready', 'pid': os.getpid()})
+
+    for line in proto_in:
+        request = json.loads(line.decode('utf8'))
+        try:
+            target = _resolve_target(request['target'], imports)
+            result = target(*request['args'], **request['kwargs'])
+            send({'status': 'ok', 'result': result})
+        except Exception as ex:
+            send({
+                'status': 'error',
+                'error': type(ex).__name__,
+                'message': str(ex),
+                'traceback': traceback.format_exc(),
+            })
+
+
+def _lower_privileges(username):
+    import pwd
+
+    userinfo = pwd.getpwnam(username)
+    if userinfo.pw_uid == 0:
+        raise PermissionError('cannot run sandbox as root')
+    os.setgid(userinfo.pw_gid)
+    os.setuid(userinfo.pw_uid)
+
+
+def _resolve_target(name, imports):
+    mod_name, _, func_name = name.rpartition('.')
+    is_allowed = any(mod_name == mod or mod_name.startswith(mod + '.')
+                     for mod in imports)
+    if not is_allowed or mod_name not in sys.modules:
+        raise ValueError('target is not in a pre-imported module: %s' % name)
+    return getattr(sys.modules[mod_name], func_name)
+
+
+if __name__ == '__main__':
+    serve()
@@ -135,3 +135,52 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TIMEZONE = 'America/Sao_Paulo'
 CELERY_ENABLE_UTC = True
 CELERY_CREATE_MISSING_QUEUES = True
+
+# Grading
+
+# Maximum number of parsed iospec trees kept in memory by each worker
+EJUDGE_IOSPEC_CACHE_SIZE = 256
+
+# Submissions that arrive before their question is expanded are re-scheduled
+# every EJUDGE_EXPANSION_WAIT seconds. After EJUDGE_EXPANSION_MAX_WAITS retries
+# they are graded against the iospec template.
+EJUDGE_EXPANSION_WAIT = 2.0
+EJUDGE_EXPANSION_MAX_WAITS = 30
+
+# New submissions to the same question are collected for EJUDGE_BATCH_WINDOW
+# seconds (or until EJUDGE_BATCH_SIZE submissions) and graded in a single task
+EJUDGE_BATCH_WINDOW = 0.5
+EJUDGE_BATCH_SIZE = 50
+
+# Clients may block on PUT requests for up to EJUDGE_MAX_WAIT seconds using the
+# ?wait=<seconds> query parameter. Work is always executed by celery workers.
+EJUDGE_MAX_WAIT = 30
+
+# Workers announce graded submissions in this Redis server so long-polling
+# requests (GET .../feedback/?wait=<seconds>) wake up immediately. Without Redis
+# the database is polled every EJUDGE_POLL_INTERVAL seconds.
+EJUDGE_REDIS_URL = 'redis://localhost:6379/0'
+EJUDGE_POLL_INTERVAL = 0.5
+
+# Feedback of submissions with a callback url is POSTed to that url. Results for
+# the same url are collected for EJUDGE_CALLBACK_WINDOW seconds (at most
+# EJUDGE_CALLBACK_BATCH_SIZE results) and sent in a single request. Failed
+# deliveries are retried with exponential backoff starting at
+# EJUDGE_CALLBACK_RETRY_DELAY seconds.
+EJUDGE_CALLBACK_WINDOW = 1.0
+EJUDGE_CALLBACK_BATCH_SIZE = 50
+EJUDGE_CALLBACK_TIMEOUT = 10
+EJUDGE_CALLBACK_RETRY_DELAY = 2.0
+EJUDGE_CALLBACK_MAX_RETRIES = 8
+
+# Sandboxed runs use pools of EJUDGE_SANDBOX_POOL_SIZE warm workers per language
+# in each worker process. Workers are recycled after EJUDGE_SANDBOX_MAX_RUNS runs
+# or if they use more than EJUDGE_SANDBOX_MAX_MEMORY megabytes. Set the pool
+# size to 0 in order to start a new sandbox for each run.
+EJUDGE_SANDBOX_POOL_SIZE = 2
+EJUDGE_SANDBOX_MAX_RUNS = 200
+EJUDGE_SANDBOX_MAX_MEMORY = 256
+EJUDGE_SANDBOX_TIMEOUT = 60
+EJUDGE_SANDBOX_USER = 'nobody'
+EJUDGE_SANDBOX_COMMAND = ['python_boxed', '-S', '-s', '-m',
+                          'ejudge_server.sandbox_worker']
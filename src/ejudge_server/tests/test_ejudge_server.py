@@ -1,5 +1,15 @@
+import sys
+import threading
+
+import mock
+import pytest
+
 import ejudge_server
-from ejudge_server.utils import full_url
+from ejudge_server import notify, callbacks
+from ejudge_server.batching import Batcher
+from ejudge_server.sandbox import SandboxPool, SandboxTimeoutError, \
+    SandboxCallError
+from ejudge_server.utils import full_url, request_wait
 
 
 def test_project_defines_author_and_version():
@@ -14,3 +24,209 @@ class TestUtils:
         assert full_url('foo/', 'bar') == 'http://localhost:8000/foo/bar'
         assert full_url('foo/', '/bar') == 'http://localhost:8000/foo/bar'
         assert full_url('foo', '/bar') == 'http://localhost:8000/foo/bar'
+
+    def test_request_wait(self):
+        def wait(value):
+            request = mock.Mock(query_params={'wait': value})
+            return request_wait(request, max_wait=10)
+
+        assert wait('2.5') == 2.5
+        assert wait('100') == 10
+        assert wait('-1') == 0
+        assert wait('nan') == 0
+        assert wait('foo') == 0
+        assert request_wait(mock.Mock(query_params={})) == 0
+
+
+class TestBatcher:
+
+    def test_flush_when_batch_is_full(self):
+        flushed = []
+        batcher = Batcher(lambda k, items: flushed.append((k, items)),
+                          window=60, max_size=2)
+        batcher.add('a', 1)
+        batcher.add('b', 2)
+        assert flushed == []
+        batcher.add('a', 3)
+        assert flushed == [('a', [1, 3])]
+        batcher.flush()
+        assert flushed == [('a', [1, 3]), ('b', [2])]
+        assert len(batcher) == 0
+
+    def test_flush_after_window(self):
+        event = threading.Event()
+        batcher = Batcher(lambda k, items: event.set(), window=0.01)
+        batcher.add('a', 1)
+        assert event.wait(1)
+
+
+class TestSandboxPool:
+
+    @pytest.fixture
+    def pool(self):
+        pool = SandboxPool(['os', 'time'], size=1, max_runs=3,
+                           command=[sys.executable, '-m',
+                                    'ejudge_server.sandbox_worker'],
+                           user=None)
+        yield pool
+        pool.close()
+
+    def test_reuse_worker(self, pool):
+        pids = {pool.run('os.getpid') for _ in range(3)}
+        assert len(pids) == 1
+        assert pool.stats()['spawns'] == 1
+
+    def test_recycle_worker_after_max_runs(self, pool):
+        pids = {pool.run('os.getpid') for _ in range(4)}
+        assert len(pids) == 2
+        assert pool.stats()['recycles'] == 1
+
+    def test_timeout_kills_worker(self, pool):
+        with pytest.raises(SandboxTimeoutError):
+            pool.run('time.sleep', (10,), timeout=0.2)
+        assert pool.run('os.getpid')
+        assert pool.stats()['spawns'] == 2
+
+    def test_only_preloaded_modules_can_be_called(self, pool):
+        with pytest.raises(SandboxCallError):
+            pool.run('shutil.rmtree', ('/tmp/nothing',))
+
+
+class TestNotify:
+
+    class FakePubSub:
+        def __init__(self, messages):
+            self.messages = messages
+            self.channels = []
+            self.closed = False
+
+        def subscribe(self, *channels):
+            self.channels.extend(channels)
+
+        def get_message(self, timeout=0):
+            if self.messages:
+                return {'channel': self.messages.pop(0).encode('utf8')}
+            return None
+
+        def close(self):
+            self.closed = True
+
+    def test_wait_feedback_polls_without_redis(self, settings):
+        settings.EJUDGE_REDIS_URL = None
+        settings.EJUDGE_POLL_INTERVAL = 0.01
+        calls = []
+
+        def is_ready(pks):
+            calls.append(sorted(pks))
+            return ['a'] if len(calls) == 1 else pks
+
+        assert notify.wait_feedback(['a', 'b'], 1, is_ready) == {'a', 'b'}
+        assert calls == [['a', 'b'], ['b']]
+
+    def test_wait_feedback_timeout(self, settings):
+        settings.EJUDGE_REDIS_URL = None
+        settings.EJUDGE_POLL_INTERVAL = 0.01
+        assert notify.wait_feedback(['a'], 0.05, lambda pks: []) == set()
+
+    def test_wait_feedback_uses_pubsub(self):
+        pubsub = self.FakePubSub([notify.channel('b'), notify.channel('c')])
+        client = mock.Mock(pubsub=lambda **kwargs: pubsub)
+
+        with mock.patch.object(notify, 'get_redis', return_value=client):
+            ready = notify.wait_feedback(['a', 'b', 'c'], 1, lambda pks: ['a'])
+
+        assert ready == {'a', 'b', 'c'}
+        assert sorted(pubsub.channels) == [notify.channel(x) for x in 'abc']
+        assert pubsub.closed
+
+
+class TestCallbacks:
+
+    @pytest.fixture
+    def server(self):
+        import json
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+
+        received = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            status = 200
+
+            def do_POST(self):
+                size = int(self.headers['Content-Length'])
+                received.append((self.path, json.loads(
+                    self.rfile.read(size).decode('utf8'))))
+                self.send_response(Handler.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        httpd = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        httpd.received = received
+        httpd.handler = Handler
+        httpd.url = 'http://127.0.0.1:%s/hook/' % httpd.server_port
+        yield httpd
+        httpd.shutdown()
+        httpd.server_close()
+
+    def test_deliver_reuses_connection(self, server):
+        pool = callbacks.ConnectionPool()
+        with mock.patch.object(callbacks, 'connection_pool', pool):
+            callbacks.deliver(server.url, [{'uuid': 'a'}])
+            callbacks.deliver(server.url, [{'uuid': 'b'}, {'uuid': 'c'}])
+        pool.close()
+        assert server.received == [
+            ('/hook/', [{'uuid': 'a'}]),
+            ('/hook/', [{'uuid': 'b'}, {'uuid': 'c'}]),
+        ]
+        assert pool.stats()['connects'] == 1
+        assert pool.stats()['requests'] == 2
+
+    def test_deliver_error_status(self, server):
+        server.handler.status = 500
+        pool = callbacks.ConnectionPool()
+        with mock.patch.object(callbacks, 'connection_pool', pool):
+            with pytest.raises(callbacks.CallbackError):
+                callbacks.deliver(server.url, [])
+        pool.close()
+
+    def test_deliver_callbacks_retries_with_backoff(self):
+        retries = []
+
+        def retry(countdown, max_retries):
+            retries.append(countdown)
+            return RuntimeError('retry')
+
+        task = callbacks.deliver_callbacks
+        with mock.patch.object(task, 'retry', retry):
+            for n in range(3):
+                task.push_request(retries=n)
+                try:
+                    with pytest.raises(RuntimeError):
+                        task.run('http://127.0.0.1:1/', [])
+                finally:
+                    task.pop_request()
+
+        delay = callbacks.RETRY_DELAY
+        assert retries == [delay, 2 * delay, 4 * delay]
+
+    def test_callbacks_are_batched_by_url(self):
+        sent = []
+        batcher = callbacks.Batcher(lambda url, items: sent.append((url, items)),
+                                    window=60)
+        with mock.patch.object(callbacks, 'callback_batcher', batcher):
+            callbacks.schedule_callback('http://a/', 1)
+            callbacks.schedule_callback('', 2)
+            callbacks.schedule_callback('http://a/', 3)
+            callbacks.schedule_callback('http://b/', 4)
+            batcher.flush()
+        assert sent == [('http://a/', [1, 3]), ('http://b/', [4])]
@@ -0,0 +1,58 @@
+from ejudge_server.question_code import grader
+from ejudge_server.question_code.grader import get_code_errors, dump_code, \
+    load_code
+
+GRADER = '''
+def grader(test, reference):
+    assert test(1, 2) == reference(1, 2)
+'''
+REFERENCE = '''
+def func(x, y):
+    return x + y
+'''
+
+
+# ------------------------------------------------------------------------------
+# GRADER
+#
+class TestGrader:
+
+    def test_correct_code(self):
+        assert get_code_errors(GRADER, REFERENCE, REFERENCE) is None
+
+    def test_wrong_answer(self):
+        code = 'def func(x, y):\n    return x - y\n'
+        assert get_code_errors(GRADER, code, REFERENCE).startswith(
+            'Wrong answer')
+
+    def test_traceback_shows_source_lines(self):
+        code = 'def func(x, y):\n    return x + y\n\n1 / 0\n'
+        error = get_code_errors(GRADER, code, REFERENCE)
+        assert 'File "code.py", line 4' in error
+        assert '1 / 0' in error
+
+    def test_reference_and_grader_are_cached(self):
+        grader.code_cache.clear()
+        get_code_errors(GRADER, REFERENCE, REFERENCE)
+        get_code_errors(GRADER, REFERENCE, REFERENCE)
+        assert grader.code_cache.stats()['misses'] == 2
+        assert grader.code_cache.stats()['hits'] == 2
+
+    def test_dump_and_load_code(self):
+        ns = {}
+        exec(load_code(dump_code(REFERENCE, 'reference.py')), ns)
+        assert ns['func'](1, 2) == 3
+
+    def test_load_code_from_incompatible_interpreter(self):
+        assert load_code(b'\0\0\0\0' + dump_code(REFERENCE)[4:]) is None
+
+    def test_grade_with_precompiled_artifacts(self):
+        grader.code_cache.clear()
+        artifacts = {
+            'grader': dump_code(GRADER, 'grader.py'),
+            'reference': dump_code('def func(x, y):\n    return 0\n'),
+        }
+        # Artifacts take precedence over sources
+        error = get_code_errors(GRADER, REFERENCE, REFERENCE,
+                                artifacts=artifacts)
+        assert error.startswith('Wrong answer')
@@ -7,9 +7,11 @@ from ejudge_server.question_io.models import IoQuestion, IoSubmission
 from ejudge_server.question_io.serializers import IoQuestionSerializer, \
     IoSubmissionSerializer
 from ejudge_server.question_io.tasks import expand_question_iospec, \
-    autograde_submission
-from ejudge_server.question_io.utils import iospec_expand, grade_submission
-from ejudge_server.question_io.views import QuestionExpansionViewSet
+    autograde_submission, autograde_submissions
+from ejudge_server.question_io.utils import iospec_expand, grade_submission, \
+    parse_iospec_cached, iospec_cache
+from ejudge_server.question_io.views import QuestionExpansionViewSet, \
+    SubmissionIoViewSet
 
 patch_object = mock.patch.object
 
@@ -116,8 +118,9 @@ class TestIoSubmission:
             scheduled = True
 
         with patch_object(Model, 'save', save):
-            with patch_object(autograde_submission, 'delay', task):
+            with patch_object(autograde_submissions, 'delay', task):
                 submission.save()
+                tasks.submission_batcher.flush()
 
         assert saved
         assert scheduled
@@ -175,6 +178,8 @@ class TestIoSubmissionSerializer:
 # UTILS
 #
 class TestUtils:
+    question = TestIoQuestion.question
+    uuid = TestIoQuestion.uuid
 
     def test_iospec_expand(self):
         iospec = '@input John'
@@ -204,6 +209,23 @@ class TestUtils:
         }
         assert grade == 100
 
+    def test_parse_iospec_cached(self):
+        iospec_cache.clear()
+        first = parse_iospec_cached('foo<bar>\nbaz')
+        second = parse_iospec_cached('foo<bar>\nbaz')
+        assert first is second
+        assert iospec_cache.stats()['hits'] == 1
+        assert iospec_cache.stats()['misses'] == 1
+
+    def test_iospec_cache_is_invalidated_on_save(self, question):
+        iospec_cache.clear()
+        with patch_object(Model, 'save', lambda *args, **kwargs: None):
+            question.save(schedule=False)
+            parse_iospec_cached(question.iospec_template)
+            question.iospec_template = 'hello world'
+            question.save(schedule=False)
+        assert len(iospec_cache) == 0
+
 
 # ------------------------------------------------------------------------------
 # TASKS
@@ -222,6 +244,8 @@ class TestTasks:
         assert question.iospec == 'hello'
 
     def test_autograde_submission(self, db, submission, question):
+        question.iospec = question.iospec_template
+        question.is_valid = True
         question.save(schedule=False)
         submission.save(schedule=False)
 
@@ -231,6 +255,100 @@ class TestTasks:
         assert submission.has_feedback
         assert submission.feedback.grade == 100
 
+    def test_autograde_submissions(self, db, question):
+        question.iospec = question.iospec_template
+        question.is_valid = True
+        question.save(schedule=False)
+        submissions = [
+            IoSubmission(question=question, source=src, language='python')
+            for src in ['print("hello")', 'print("hi")']
+        ]
+        for submission in submissions:
+            submission.save(schedule=False)
+
+        with mock.patch('ejudge_server.question_io.utils.SANDBOX', False):
+            tasks.autograde_submissions([str(x.pk) for x in submissions])
+
+        grades = [IoSubmission.objects.get(pk=x.pk).feedback.grade
+                  for x in submissions]
+        assert grades == [100, 0]
+
+    def test_autograde_submissions_schedule_callbacks(self, db, question):
+        from ejudge_server.callbacks import deliver_callbacks
+
+        question.save(schedule=False)
+        url = 'http://codeschool.example.com/hook/'
+        submissions = []
+        for i in range(3):
+            submission = IoSubmission(
+                question=question, language='python', source='print(%s)' % i,
+                callback_url=url if i else '')
+            submission.save(schedule=False)
+            submissions.append(submission)
+
+        with patch_object(IoSubmission, '_grade_submission',
+                          staticmethod(lambda *args: (100, {}))), \
+                patch_object(deliver_callbacks, 'delay') as delay:
+            autograde_submissions([str(x.pk) for x in submissions])
+
+        (args, _), = delay.call_args_list
+        assert args[0] == url
+        assert sorted(item['uuid'] for item in args[1]) == \
+            sorted(str(x.pk) for x in submissions[1:])
+        assert args[1][0]['grade'] == 100.0
+
+    def test_identical_submissions_reuse_feedback(self, db, question):
+        question.save(schedule=False)
+        first = IoSubmission(question=question, source='print("hello")',
+                             language='python')
+        second = IoSubmission(question=question, source='print("hello")  \n',
+                              language='python')
+        first.save(schedule=False)
+        second.save(schedule=False)
+        assert first.source_hash == second.source_hash
+
+        grade = mock.Mock(return_value=(100.0, {}))
+        with patch_object(IoSubmission, '_grade_submission', grade):
+            first.feedback_auto()
+            assert second.feedback_auto().grade == 100
+        assert grade.call_count == 1
+
+        # Expanding the question invalidates the cached feedback
+        question.iospec = 'hello\n\nhello'
+        question.is_valid = True
+        question.save(schedule=False)
+        third = IoSubmission(question=question, source='print("hello")',
+                             language='python')
+        third.save(schedule=False)
+        with patch_object(IoSubmission, '_grade_submission', grade):
+            third.feedback_auto()
+        assert grade.call_count == 2
+
+    def test_autograde_submission_waits_expansion(self, db, submission,
+                                                   question):
+        question.save(schedule=False)
+        submission.save(schedule=False)
+
+        def retry(**kwargs):
+            raise RuntimeError('retry')
+
+        with patch_object(autograde_submission, 'retry', retry):
+            with pytest.raises(RuntimeError):
+                tasks.autograde_submission(submission.pk)
+        submission.refresh_from_db()
+        assert not submission.has_feedback
+
+    def test_changing_template_resets_expansion(self, db, question):
+        question.iospec = question.iospec_template
+        question.is_valid = True
+        question.save(schedule=False)
+
+        question = IoQuestion.objects.get(pk=question.pk)
+        question.iospec_template = 'hello world'
+        question.save(schedule=False)
+        assert question.iospec == ''
+        assert not question.is_valid
+
 
 # ------------------------------------------------------------------------------
 # VIEWS
@@ -251,22 +369,250 @@ class TestExpansionViewSet:
                     'is_valid': False,
                 }
 
-    def test_question_iospec_update(self, question, uuid, rf):
-        request = rf.get('/api/io/questions/%s/iospec/' % uuid)
-        request.data = {'num_expansions': 2}
-        viewset = QuestionExpansionViewSet(kwargs={'pk': uuid})
-        iospec = question.iospec_template
+    @pytest.fixture
+    def put(self, admin_user):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from ejudge_server.question_io.views import question_iospec_view, \
+            submission_feedback_view
 
-        patch_get_object = patch_object(
-            QuestionExpansionViewSet, 'get_object', lambda x: question
-        )
-        patch_expand_inplace = patch_object(
-            IoQuestion, 'expand_inplace', lambda x: setattr(
-                x, 'iospec', iospec)
-        )
+        views = {'iospec': question_iospec_view,
+                 'feedback': submission_feedback_view}
+
+        def put(url, data=None):
+            request = APIRequestFactory().put(url, data or {}, format='json')
+            force_authenticate(request, admin_user)
+            pk = url.split('/')[4]
+            return views[url.split('/')[5]](request, pk=pk)
+
+        return put
+
+    def test_question_iospec_update(self, db, question, uuid, put):
+        question.save(schedule=False)
+        result = mock.Mock(id='task-id')
+
+        with patch_object(expand_question_iospec, 'delay',
+                          return_value=result) as delay:
+            response = put('/api/io/questions/%s/iospec/' % uuid,
+                           {'num_expansions': 2})
+
+        delay.assert_called_once_with(question.pk)
+        assert response.status_code == 202
+        assert response.data == {
+            'iospec': '',
+            'is_valid': False,
+            'status': 'pending',
+            'task': 'task-id',
+        }
+        assert response['Location'].endswith('/questions/%s/iospec/' % uuid)
+        assert IoQuestion.objects.get(pk=uuid).num_expansions == 2
+
+    def test_question_iospec_update_wait(self, db, question, uuid, put):
+        question.save(schedule=False)
+
+        def delay(pk):
+            with patch_object(IoQuestion, '_iospec_expand',
+                              staticmethod(lambda t, *args: t)):
+                expand_question_iospec(pk)
+            return mock.Mock(successful=lambda: True)
+
+        with patch_object(expand_question_iospec, 'delay', delay):
+            response = put('/api/io/questions/%s/iospec/?wait=5' % uuid)
+
+        assert response.status_code == 200
+        assert response.data == {'iospec': 'hello', 'is_valid': True}
 
-        with patch_get_object, patch_expand_inplace:
-            assert viewset.update(request) == {
-                'iospec': 'hello',
-                'is_valid': False,
-            }
+    def test_question_iospec_update_valid(self, db, question, uuid, put):
+        question.iospec = question.iospec_template
+        question.is_valid = True
+        question.save(schedule=False)
+
+        with patch_object(expand_question_iospec, 'delay') as delay:
+            response = put('/api/io/questions/%s/iospec/' % uuid)
+
+        assert not delay.called
+        assert response.status_code == 200
+
+    def test_submission_feedback_update_timeout(self, db, question, put):
+        from celery.exceptions import TimeoutError
+
+        question.save(schedule=False)
+        submission = IoSubmission(question=question, source='print(1)',
+                                  language='python')
+        submission.save(schedule=False)
+        result = mock.Mock(id='task-id')
+        result.get.side_effect = TimeoutError
+
+        with patch_object(autograde_submission, 'delay',
+                          return_value=result) as delay:
+            response = put(
+                '/api/io/submissions/%s/feedback/?wait=0.1' % submission.pk)
+
+        delay.assert_called_once_with(str(submission.pk))
+        result.get.assert_called_once_with(timeout=0.1, propagate=False)
+        assert response.status_code == 202
+        assert response.data['status'] == 'pending'
+        assert response.data['has_feedback'] is False
+
+
+class TestSubmissionBulk:
+    question = TestIoQuestion.question
+    uuid = TestIoQuestion.uuid
+
+    @pytest.fixture
+    def bulk_view(self, admin_user):
+        from rest_framework.test import force_authenticate
+
+        view = SubmissionIoViewSet.as_view(
+            {'post': 'bulk'}, **SubmissionIoViewSet.bulk.kwargs)
+
+        def bulk(request):
+            force_authenticate(request, admin_user)
+            return view(request)
+
+        return bulk
+
+    def test_bulk_create_json(self, db, question, uuid, bulk_view):
+        from rest_framework.test import APIRequestFactory
+
+        question.save(schedule=False)
+        url = 'http://testserver/api/io/questions/%s/' % uuid
+        data = [
+            {'question': url, 'source': 'print("hello")', 'language': 'python'},
+            {'question': uuid, 'source': 'print(42)', 'language': 'python'},
+        ]
+        request = APIRequestFactory().post(
+            '/api/io/submissions/bulk/', data, format='json')
+
+        with patch_object(autograde_submissions, 'delay') as delay:
+            response = bulk_view(request)
+
+        assert response.status_code == 201
+        assert len(response.data) == 2
+        pks = [item['uuid'] for item in response.data]
+        assert IoSubmission.objects.filter(pk__in=pks).count() == 2
+        assert delay.call_args_list == [mock.call(pks)]
+        assert response.data[0]['url'].endswith(
+            '/api/io/submissions/%s/' % pks[0])
+
+    def test_bulk_create_ndjson(self, db, question, uuid, bulk_view):
+        from rest_framework.test import APIRequestFactory
+
+        question.save(schedule=False)
+        lines = [
+            '{"question": "%s", "source": "print(%s)", "language": "python"}'
+            % (uuid, i) for i in range(3)
+        ]
+        request = APIRequestFactory().post(
+            '/api/io/submissions/bulk/', '\n'.join(lines),
+            content_type='application/x-ndjson')
+
+        with patch_object(tasks.submission_batcher, 'max_size', 2), \
+                patch_object(autograde_submissions, 'delay') as delay:
+            response = bulk_view(request)
+
+        assert response.status_code == 201
+        assert [len(call[0][0]) for call in delay.call_args_list] == [2, 1]
+        assert IoSubmission.objects.filter(source_hash='').count() == 0
+
+    def test_bulk_create_missing_question(self, db, uuid, bulk_view):
+        from rest_framework.test import APIRequestFactory
+
+        data = [{'question': uuid, 'source': 'x', 'language': 'python'}]
+        request = APIRequestFactory().post(
+            '/api/io/submissions/bulk/', data, format='json')
+
+        with patch_object(autograde_submissions, 'delay') as delay:
+            response = bulk_view(request)
+
+        assert response.status_code == 400
+        assert not delay.called
+        assert IoSubmission.objects.count() == 0
+
+
+class TestSubmissionList:
+    question = TestIoQuestion.question
+    uuid = TestIoQuestion.uuid
+
+    def list_queries(self, question, admin_user, size):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from rest_framework.test import APIRequestFactory, force_authenticate
+
+        for i in range(size):
+            submission = IoSubmission(question=question, language='python',
+                                      source='print(%s)' % i)
+            submission.save(schedule=False)
+            submission.feedback_auto()
+
+        view = SubmissionIoViewSet.as_view({'get': 'list'})
+        request = APIRequestFactory().get('/api/io/submissions/')
+        force_authenticate(request, admin_user)
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request)
+            response.render()
+        results = response.data['results']
+        assert len(results) == IoSubmission.objects.count()
+        assert all(item['grade'] is not None for item in results)
+        return len(queries)
+
+    def test_list_queries_do_not_grow(self, db, question, admin_user):
+        question.save(schedule=False)
+        with patch_object(IoSubmission, '_grade_submission',
+                          staticmethod(lambda *args: (100, {}))):
+            small = self.list_queries(question, admin_user, 2)
+            large = self.list_queries(question, admin_user, 13)
+        assert small == large
+
+
+class TestSubmissionFeedbackQuery:
+    question = TestIoQuestion.question
+    uuid = TestIoQuestion.uuid
+
+    def get(self, url, user):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+
+        view = SubmissionIoViewSet.as_view({'get': 'feedback'})
+        request = APIRequestFactory().get(url)
+        force_authenticate(request, user)
+        return view(request)
+
+    def test_feedback_of_many_submissions(self, db, question, admin_user):
+        question.save(schedule=False)
+        graded, pending = [
+            IoSubmission(question=question, source='print(%s)' % i,
+                         language='python')
+            for i in range(2)
+        ]
+        with patch_object(IoSubmission, '_grade_submission',
+                          staticmethod(lambda *args: (100, {}))):
+            for submission in (graded, pending):
+                submission.save(schedule=False)
+            graded.feedback_auto()
+
+            def wait_feedback(pks, timeout, is_ready):
+                assert pks == [str(pending.pk)]
+                assert timeout == 5
+                pending.feedback_auto()
+                return set(is_ready(pks))
+
+            url = '/api/io/submissions/feedback/?uuid=%s,%s' % (
+                graded.pk, pending.pk)
+            response = self.get(url, admin_user)
+            assert response.status_code == 200
+            assert response.data['pending'] == [str(pending.pk)]
+            assert [x['has_feedback'] for x in response.data['results']] == \
+                [True, False]
+
+            with mock.patch('ejudge_server.question_io.views.wait_feedback',
+                            wait_feedback):
+                response = self.get(url + '&wait=5', admin_user)
+            assert response.data['pending'] == []
+            assert response.data['results'][1]['grade'] == 100
+
+    def test_feedback_of_unknown_submission(self, db, admin_user, uuid):
+        response = self.get('/api/io/submissions/feedback/?uuid=' + uuid,
+                            admin_user)
+        assert response.status_code == 404
+        response = self.get('/api/io/submissions/feedback/?uuid=foo',
+                            admin_user)
+        assert response.status_code == 400
@@ -1,5 +1,7 @@
 from functools import reduce
 
+from django.conf import settings
+
 
 def hostname():
     """
@@ -24,3 +26,40 @@ def full_url(url, *args):
 
     path = (hostname(), url) + args
     return reduce(join_path, path)
+
+
+def request_wait(request, max_wait=None):
+    """
+    Return the number of seconds given in the ?wait=<seconds> query parameter.
+
+    The result is clamped to the [0, max_wait] interval. max_wait defaults to
+    the EJUDGE_MAX_WAIT setting. Invalid or missing values are treated as 0.
+    """
+
+    if max_wait is None:
+        max_wait = getattr(settings, 'EJUDGE_MAX_WAIT', 30)
+    try:
+        wait = float(request.query_params.get('wait', 0))
+    except (TypeError, ValueError):
+        return 0.0
+    if wait != wait:  # NaN
+        return 0.0
+    return min(max(wait, 0.0), max_wait)
+
+
+def wait_result(result, timeout):
+    """
+    Wait at most timeout seconds for the given celery AsyncResult.
+
+    Return True if the task finished successfully.
+    """
+
+    from celery.exceptions import TimeoutError
+
+    if timeout <= 0:
+        return False
+    try:
+        result.get(timeout=timeout, propagate=False)
+    except TimeoutError:
+        return False
+    return result.successful()